@@ -1,26 +1,207 @@
-import tweepy
 import time
+import asyncio
 import random
 import logging
+import logging.handlers
+import queue
 import os
-import requests
-from datetime import datetime
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("cryptoxpress_bot.log"),
-        logging.StreamHandler()
-    ]
-)
+import hashlib
+import sqlite3
+import atexit
+import pickle
+import collections
+import textwrap
+from types import MappingProxyType
+import orjson
+from datetime import datetime, timedelta
+
+# tweepy, requests and dotenv are imported where they are first needed to keep imports cheap
+
+# Logging handlers are only installed by setup_logging(), so importing the module stays side-effect free
 logger = logging.getLogger("CryptoXpressBot")
+log_listener = None
+
+# Bots scheduled on an already running event loop; the loop only keeps weak references to tasks
+bot_tasks = set()
+
+# Posted tweets are indexed by fixed-width digests rather than raw text
+POSTED_TWEETS_FILE = "posted_tweets.txt"
+POSTED_DB_FILE = "posted_tweets.db"
+DIGEST_SIZE = 16
+
+# Generated tweets whose SimHash is this close to a posted tweet count as duplicates.
+# One-word swaps such as "no" vs "zero commissions" are about 6 bits apart, while local
+# fills of different features are at least 10 apart (see simhash_distance)
+SIMHASH_BITS = 64
+SIMHASH_SHINGLE_SIZE = 4
+SIMHASH_MAX_DISTANCE = 8
+
+# Generated tweets are cached per prompt template to skip repeated API calls
+GEN_CACHE_FILE = "generation_cache.pkl"
+GEN_CACHE_SIZE = 16
+GEN_CACHE_MIN_HITS = 4
+GEN_CACHE_HIT_RATE = 0.7
+
+# AI API endpoints share one pooled session
+HF_API_BASE = "https://api-inference.huggingface.co"
+TEXTGEN_API_BASE = "https://api.textgen.dev"
+HTTP_TIMEOUT = (3, 30)  # (connect, read) seconds
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# A provider is skipped for a while after it rate limits us or fails server-side
+BREAKER_DEFAULT_SECONDS = 300
+
+# Hugging Face model, overridable with the HF_MODEL environment variable
+HF_DEFAULT_MODEL = "Qwen/Qwen2.5-1.5B-Instruct"
+HF_MAX_NEW_TOKENS = 80  # a 280 character tweet is well under 80 tokens
+
+# Number of tweets requested from Hugging Face per call
+HF_BATCH_SIZE = 20
+
+# Generation is cut off server-side once the tweet paragraph ends
+HF_STOP_SEQUENCES = ["\n\n"]
+
+# Quotes and whitespace stripped from the ends of generated text
+TWEET_STRIP_CHARS = "\"' \t\r\n"
+
+
+# Company info for context
+COMPANY_INFO = MappingProxyType({
+    "name": "CryptoXpress",
+    "mission": "Make crypto easy",
+    "features": (
+        "Trade over 300 cryptocurrencies with 900+ trading pairs",
+        "No commissions on trades",
+        "Book flights, accommodation, tours with crypto",
+        "Pay bills and services with crypto",
+        "Digital wallet for cryptocurrency holdings",
+        "Bridge between crypto world and everyday life",
+        "NFT management",
+        "Crypto payments and transfers"
+    )
+})
+
+# AI prompt templates for different tweet styles
+PROMPT_TEMPLATES = (
+    "Write a short, engaging tweet for CryptoXpress about making crypto easy for everyday use. Keep it under 260 characters.",
+    "Create a tweet for CryptoXpress highlighting our no-commission trading feature. Keep it under 260 characters.",
+    "Write a tweet for CryptoXpress about using crypto for travel bookings. Keep it under 260 characters.",
+    "Create a tweet for CryptoXpress about paying bills with crypto. Keep it under 260 characters.",
+    "Write an engaging tweet for CryptoXpress about our digital wallet features. Keep it under 260 characters.",
+    "Create a tweet for CryptoXpress about managing NFTs in our platform. Keep it under 260 characters.",
+    "Write a tweet for CryptoXpress emphasizing our 300+ cryptocurrencies and 900+ trading pairs. Keep it under 260 characters.",
+    "Create a tweet for CryptoXpress about being the bridge between crypto and everyday life. Keep it under 260 characters."
+)
+
+# For hashtags
+HASHTAGS = (
+    "#CryptoXpress", "#CX", "#Crypto", "#Cryptocurrency", "#NFT", 
+    "#Trading", "#CryptoTrading", "#CryptoPayments", "#DigitalWallet",
+    "#CryptoTravel", "#CryptoShopping", "#CryptoLife", "#CryptoMadeEasy"
+)
+
+# Local tweet templates filled from company features, used before calling any AI API
+LOCAL_TEMPLATES = (
+    "{verb} CryptoXpress: {feature}. {hashtag}",
+    "{feature}. {verb} it today with CryptoXpress! {hashtag}",
+    "Did you know? {feature} - all in one place on CryptoXpress. {hashtag}",
+    "Making crypto easy: {feature}. {verb} CryptoXpress today! {hashtag}"
+)
+VERBS = ("Discover", "Enjoy", "Try", "Explore")
+
+# Backup tweets in case AI generation fails
+BACKUP_TWEETS = (
+    "Buy and sell over 300 cryptocurrencies with 900+ trading pairs using only 3 clicks, without paying any commissions. #CryptoXpress #CryptoMadeEasy",
+    "Book flights, accommodation, tours, rental cars and much more directly from CryptoXpress. Your crypto, your travel plans! #CryptoTravel #CX",
+    "We're on a mission to make crypto easy! CryptoXpress is the bridge between your crypto world and everyday life. #CryptoXpress #CryptoLife",
+    "Pay bills, transfer money, and maintain your cryptocurrency holdings all in one digital wallet. That's the CryptoXpress way! #DigitalWallet #CryptoPayments",
+    "Trading crypto shouldn't be rocket science. With CryptoXpress, it's just 3 clicks to buy and sell - commission-free! #CryptoTrading #CX",
+    "From NFTs to bill payments, CryptoXpress brings everything together in one best-in-class digital experience. #NFT #CryptoMadeEasy",
+    "Why keep your crypto locked away? Use it to book your next vacation with CryptoXpress! #CryptoTravel #CryptoShopping",
+    "Over 300 cryptocurrencies, 900+ trading pairs, 0 commissions. That's the CryptoXpress advantage! #CryptoTrading #CX"
+)
+
+# Static context prepended to every prompt template
+CONTEXT_PREFIX = textwrap.dedent("""\
+    CryptoXpress is a platform that makes crypto easy for everyday use.
+    Key features:
+    - Trade 300+ cryptocurrencies with 900+ trading pairs with no commissions
+    - Book travel, accommodation, and experiences using crypto
+    - Pay bills and services with cryptocurrency
+    - Digital wallet for crypto holdings
+    - NFT management
+    - Bridge between crypto world and everyday life
+
+    """)
+
+
+def setup_logging():
+    """
+    Set up logging for the bot
+    Records are queued by the caller and written to the console and the log file by a
+    background listener thread, so logging never blocks on I/O. Calling this again is a no-op
+    """
+    global log_listener
+    if log_listener is not None:
+        return
+    
+    log_queue = queue.SimpleQueue()
+    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_file_handler = logging.handlers.RotatingFileHandler(
+        "cryptoxpress_bot.log", maxBytes=10 * 1024 * 1024, backupCount=3
+    )
+    log_file_handler.setFormatter(log_formatter)
+    log_stream_handler = logging.StreamHandler()
+    log_stream_handler.setFormatter(log_formatter)
+    log_listener = logging.handlers.QueueListener(log_queue, log_file_handler, log_stream_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def tweet_digest(tweet_text):
+    # Compact fixed-width key used for duplicate checks
+    return hashlib.blake2b(tweet_text.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def strip_hashtags(tweet_text):
+    # The tweet sentence without its hashtags, so a new hashtag doesn't make a new tweet
+    return " ".join(word for word in tweet_text.split() if not word.startswith("#"))
+
+
+def tweet_simhash(tweet_text):
+    # 64-bit SimHash over character shingles, so rewordings of a tweet land a few bits apart
+    # Hashtags are left out so swapping one doesn't move the hash
+    text = strip_hashtags(tweet_text.lower())
+    weights = [0] * SIMHASH_BITS
+    for i in range(max(len(text) - SIMHASH_SHINGLE_SIZE + 1, 1)):
+        shingle = text[i:i + SIMHASH_SHINGLE_SIZE]
+        shingle_hash = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=SIMHASH_BITS // 8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if shingle_hash >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def simhash_distance(hash_a, hash_b):
+    """
+    Number of bits in which two SimHashes differ
+    
+    >>> simhash_distance(tweet_simhash("Trade 300+ cryptocurrencies with no commissions! #CX"),
+    ...                  tweet_simhash("Trade 300+ cryptocurrencies with zero commissions! #CX"))
+    6
+    >>> simhash_distance(tweet_simhash("Making crypto easy: NFT management. Discover CryptoXpress today!"),
+    ...                  tweet_simhash("Making crypto easy: Pay bills and services with crypto. Discover CryptoXpress today!"))
+    10
+    """
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def to_signed64(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
 
 
 class CryptoXpressBot:
@@ -29,284 +210,546 @@ class CryptoXpressBot:
     using AI text generation APIs.
     """
     
+    __slots__ = (
+        "twitter_client", "_rate_limit_remaining", "_rate_limit_reset",
+        "db", "_posted_fd", "_posted_hashes", "hf_api_key", "http",
+        "_tweet_buffer", "_gen_cache", "_n_prompts", "_n_hashtags", "_local_fills", "_avail_backups",
+        "_hf_model", "_hf_api_url", "_hf_headers", "_hf_base_payload", "_breaker"
+    )
+    
+    # Tweet content, override in a subclass to customize
+    COMPANY_INFO = COMPANY_INFO
+    PROMPT_TEMPLATES = PROMPT_TEMPLATES
+    HASHTAGS = HASHTAGS
+    LOCAL_TEMPLATES = LOCAL_TEMPLATES
+    VERBS = VERBS
+    BACKUP_TWEETS = BACKUP_TWEETS
+    CONTEXT_PREFIX = CONTEXT_PREFIX
+    
     def __init__(self, twitter_credentials, hf_api_key=None):
         
         self.setup_twitter_api(twitter_credentials)
-        self.posted_tweets = set()
-        self.load_posted_tweets()
+        self._rate_limit_remaining = None
+        self._rate_limit_reset = None
+        self.setup_posted_tweets_db()
         self.hf_api_key = hf_api_key
+        self.setup_http_session()
+        # Per-provider monotonic time until which API calls are skipped
+        self._breaker = {"hf": 0.0, "textgen": 0.0}
+        # Unposted leftovers of Hugging Face batches, served before any API call
+        self._tweet_buffer = collections.deque()
+        self._gen_cache = collections.defaultdict(lambda: collections.deque(maxlen=GEN_CACHE_SIZE))
+        self.load_generation_cache()
+        atexit.register(self.save_generation_cache)
         
-        # Company info for context
-        self.company_info = {
-            "name": "CryptoXpress",
-            "mission": "Make crypto easy",
-            "features": [
-                "Trade over 300 cryptocurrencies with 900+ trading pairs",
-                "No commissions on trades",
-                "Book flights, accommodation, tours with crypto",
-                "Pay bills and services with crypto",
-                "Digital wallet for cryptocurrency holdings",
-                "Bridge between crypto world and everyday life",
-                "NFT management",
-                "Crypto payments and transfers"
-            ]
-        }
+        # Lengths used for random index selection
+        self._n_prompts = len(self.PROMPT_TEMPLATES)
+        self._n_hashtags = len(self.HASHTAGS)
         
-        # AI prompt templates for different tweet styles
-        self.prompt_templates = [
-            "Write a short, engaging tweet for CryptoXpress about making crypto easy for everyday use. Keep it under 260 characters.",
-            "Create a tweet for CryptoXpress highlighting our no-commission trading feature. Keep it under 260 characters.",
-            "Write a tweet for CryptoXpress about using crypto for travel bookings. Keep it under 260 characters.",
-            "Create a tweet for CryptoXpress about paying bills with crypto. Keep it under 260 characters.",
-            "Write an engaging tweet for CryptoXpress about our digital wallet features. Keep it under 260 characters.",
-            "Create a tweet for CryptoXpress about managing NFTs in our platform. Keep it under 260 characters.",
-            "Write a tweet for CryptoXpress emphasizing our 300+ cryptocurrencies and 900+ trading pairs. Keep it under 260 characters.",
-            "Create a tweet for CryptoXpress about being the bridge between crypto and everyday life. Keep it under 260 characters."
-        ]
+        # One template fill per distinct local sentence (templates without a verb repeat otherwise),
+        # with its SimHash to tell which feature the last posted tweet was about
+        self._local_fills = tuple(
+            (sentence, template, verb, feature, tweet_simhash(sentence))
+            for sentence, (template, verb, feature) in {
+                strip_hashtags(template.format(verb=verb, feature=feature, hashtag="")): (template, verb, feature)
+                for template in self.LOCAL_TEMPLATES
+                for verb in self.VERBS
+                for feature in self.COMPANY_INFO["features"]
+            }.items()
+        )
         
-        # For hashtags
-        self.hashtags = [
-            "#CryptoXpress", "#CX", "#Crypto", "#Cryptocurrency", "#NFT", 
-            "#Trading", "#CryptoTrading", "#CryptoPayments", "#DigitalWallet",
-            "#CryptoTravel", "#CryptoShopping", "#CryptoLife", "#CryptoMadeEasy"
-        ]
+        # Backup tweets not posted yet, updated as tweets are posted
+        self._avail_backups = {tweet for tweet in self.BACKUP_TWEETS if not self.is_posted(tweet)}
         
-        # Backup tweets in case AI generation fails
-        self.backup_tweets = [
-            "Buy and sell over 300 cryptocurrencies with 900+ trading pairs using only 3 clicks, without paying any commissions. #CryptoXpress #CryptoMadeEasy",
-            "Book flights, accommodation, tours, rental cars and much more directly from CryptoXpress. Your crypto, your travel plans! #CryptoTravel #CX",
-            "We're on a mission to make crypto easy! CryptoXpress is the bridge between your crypto world and everyday life. #CryptoXpress #CryptoLife",
-            "Pay bills, transfer money, and maintain your cryptocurrency holdings all in one digital wallet. That's the CryptoXpress way! #DigitalWallet #CryptoPayments",
-            "Trading crypto shouldn't be rocket science. With CryptoXpress, it's just 3 clicks to buy and sell - commission-free! #CryptoTrading #CX",
-            "From NFTs to bill payments, CryptoXpress brings everything together in one best-in-class digital experience. #NFT #CryptoMadeEasy",
-            "Why keep your crypto locked away? Use it to book your next vacation with CryptoXpress! #CryptoTravel #CryptoShopping",
-            "Over 300 cryptocurrencies, 900+ trading pairs, 0 commissions. That's the CryptoXpress advantage! #CryptoTrading #CX"
-        ]
+        # Hugging Face request parts that do not change between calls
+        # A small instruct model is plenty for a single tweet and much faster than a 7B one
+        self._hf_model = os.getenv("HF_MODEL", HF_DEFAULT_MODEL)
+        self._hf_api_url = f"{HF_API_BASE}/models/{self._hf_model}"
+        self._hf_headers = {"Authorization": f"Bearer {self.hf_api_key}"} if self.hf_api_key else {}
+        self._hf_headers.update(JSON_HEADERS)
+        # The Inference API caches whole responses to identical inputs by default. There are
+        # only a few distinct prompts, so turn that off to get new tweets on every call
+        self._hf_headers["X-use-cache"] = "false"
+        self._hf_base_payload = {
+            "parameters": {
+                "max_new_tokens": HF_MAX_NEW_TOKENS,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "do_sample": True,
+                "num_return_sequences": HF_BATCH_SIZE,
+                # Stop at the end of the first paragraph and don't echo the prompt back
+                "stop": HF_STOP_SEQUENCES,
+                "return_full_text": False
+            },
+            "options": {
+                "use_cache": False
+            }
+        }
         
     def setup_twitter_api(self, credentials):
         """
         Set up Twitter API connection using tweepy
         """
+        import requests
+        import tweepy
+        
         try:
             client = tweepy.Client(
                 consumer_key=credentials['consumer_key'],
                 consumer_secret=credentials['consumer_secret'],
                 access_token=credentials['access_token'],
-                access_token_secret=credentials['access_token_secret']
+                access_token_secret=credentials['access_token_secret'],
+                # Return raw responses so the rate limit headers can be read
+                return_type=requests.Response
             )
             self.twitter_client = client
             logger.info("Twitter API connection established successfully")
         except Exception as e:
-            logger.error(f"Failed to connect to Twitter API: {str(e)}")
+            logger.error("Failed to connect to Twitter API: %s", e)
             raise
             
-    def load_posted_tweets(self):
+    def update_rate_limit(self, headers):
+        # Record the tweet rate limit state from Twitter API response headers
+        try:
+            if "x-rate-limit-remaining" in headers:
+                self._rate_limit_remaining = int(headers["x-rate-limit-remaining"])
+            if "x-rate-limit-reset" in headers:
+                self._rate_limit_reset = int(headers["x-rate-limit-reset"])
+        except ValueError as e:
+            logger.error("Error parsing rate limit headers: %s", e)
+    
+    def get_rate_limit_delay(self):
+        """
+        Get the number of seconds to wait between tweets to stay within the rate limit window
+        
+        Returns:
+            float: Seconds until the next tweet can be posted, or 0 if no limit is known
+        """
+        if self._rate_limit_remaining is None or self._rate_limit_reset is None:
+            return 0
+        seconds_to_reset = self._rate_limit_reset - time.time()
+        if seconds_to_reset <= 0:
+            return 0
+        # Spread the remaining requests evenly over the rest of the window
+        return seconds_to_reset / max(self._rate_limit_remaining, 1)
+            
+    def setup_http_session(self):
+        """
+        Set up a persistent HTTP session so AI API calls reuse pooled keep-alive connections
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        # Only retry failed connections; 429 and 5xx responses go straight to the circuit breaker
+        retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5,
+                      respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+        self.http = requests.Session()
+        self.http.mount(HF_API_BASE, adapter)
+        self.http.mount(TEXTGEN_API_BASE, adapter)
+            
+    def setup_posted_tweets_db(self):
         """
-        Load previously posted tweets from a file to avoid duplicates  
-        The tweets are stored in posted_tweets.txt, one tweet per line
+        Open the SQLite index of previously posted tweets used to avoid duplicates,
+        and the posted tweets file that new tweets are appended to
+        Tweets are stored as 16-byte digests (with and without hashtags) and 64-bit
+        SimHashes in posted_tweets.db.
+        If the database is new, it is filled once from posted_tweets.txt
         """
         try:
-            if os.path.exists("posted_tweets.txt"):
-                with open("posted_tweets.txt", "r") as f:
-                    for line in f:
-                        self.posted_tweets.add(line.strip())
-                logger.info(f"Loaded {len(self.posted_tweets)} previously posted tweets")
+            self.db = sqlite3.connect(POSTED_DB_FILE, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS posted_tweets(digest BLOB PRIMARY KEY) WITHOUT ROWID")
+            self.db.execute("CREATE TABLE IF NOT EXISTS posted_simhashes(simhash INTEGER NOT NULL)")
+            
+            has_digests = self.db.execute("SELECT 1 FROM posted_tweets LIMIT 1").fetchone() is not None
+            has_simhashes = self.db.execute("SELECT 1 FROM posted_simhashes LIMIT 1").fetchone() is not None
+            if not (has_digests and has_simhashes) and os.path.exists(POSTED_TWEETS_FILE):
+                with open(POSTED_TWEETS_FILE, "r") as f:
+                    tweets = [line.strip() for line in f]
+                with self.db:
+                    self.db.execute("BEGIN")
+                    if not has_digests:
+                        self.db.executemany("INSERT OR IGNORE INTO posted_tweets VALUES(?)",
+                                            ((tweet_digest(text),) for tweet in tweets
+                                             for text in (tweet, strip_hashtags(tweet))))
+                    if not has_simhashes:
+                        self.db.executemany("INSERT INTO posted_simhashes VALUES(?)",
+                                            ((to_signed64(tweet_simhash(tweet)),) for tweet in tweets))
+                logger.info("Imported previously posted tweets from %s", POSTED_TWEETS_FILE)
+            
+            # SimHashes are compared against every candidate, so keep them in memory
+            self._posted_hashes = [simhash & ((1 << 64) - 1)
+                                   for (simhash,) in self.db.execute("SELECT simhash FROM posted_simhashes ORDER BY rowid")]
+            logger.info("Using posted tweets database %s", POSTED_DB_FILE)
+            
+            # Keep the posted tweets file open for appending; O_APPEND writes are atomic
+            self._posted_fd = os.open(POSTED_TWEETS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            atexit.register(os.close, self._posted_fd)
         except Exception as e:
-            logger.error(f"Error loading posted tweets: {str(e)}")
+            logger.error("Error opening posted tweets database: %s", e)
+            raise
+    
+    def is_posted(self, tweet_text):
+        # Check whether a tweet has been posted before
+        return self.db.execute("SELECT 1 FROM posted_tweets WHERE digest=?",
+                               (tweet_digest(tweet_text),)).fetchone() is not None
+    
+    def is_sentence_posted(self, tweet_text):
+        # Check whether the same tweet, ignoring hashtags, has been posted before
+        return self.is_posted(strip_hashtags(tweet_text))
+    
+    def is_near_duplicate(self, tweet_text):
+        # Check whether a tweet is a close rewording of one posted before
+        candidate = tweet_simhash(tweet_text)
+        return any(simhash_distance(candidate, posted) <= SIMHASH_MAX_DISTANCE
+                   for posted in self._posted_hashes)
     
     def save_posted_tweet(self, tweet_text):
-        # Save a tweet to the posted tweets file
+        # Record a posted tweet in the database and append it to the posted tweets file
         try:
-            with open("posted_tweets.txt", "a") as f:
-                f.write(tweet_text + "\n")
+            simhash = tweet_simhash(tweet_text)
+            self._posted_hashes.append(simhash)
+            self.db.executemany("INSERT OR IGNORE INTO posted_tweets VALUES(?)",
+                                [(tweet_digest(tweet_text),), (tweet_digest(strip_hashtags(tweet_text)),)])
+            self.db.execute("INSERT INTO posted_simhashes VALUES(?)", (to_signed64(simhash),))
+            os.write(self._posted_fd, (tweet_text + "\n").encode())
         except Exception as e:
-            logger.error(f"Error saving posted tweet: {str(e)}")
+            logger.error("Error saving posted tweet: %s", e)
+    
+    def load_generation_cache(self):
+        # Load cached generations and batch leftovers from a previous run
+        try:
+            if os.path.exists(GEN_CACHE_FILE):
+                with open(GEN_CACHE_FILE, "rb") as f:
+                    saved = pickle.load(f)
+                for prompt_template, tweets in saved["cache"].items():
+                    self._gen_cache[prompt_template].extend(tweets)
+                self._tweet_buffer.extend(saved["batch"])
+                logger.info("Loaded cached generations for %s prompt templates and %s batch tweets",
+                            len(self._gen_cache), len(self._tweet_buffer))
+        except Exception as e:
+            logger.error("Error loading generation cache: %s", e)
+    
+    def save_generation_cache(self):
+        # Persist cached generations and batch leftovers so the next run starts warm
+        try:
+            with open(GEN_CACHE_FILE, "wb") as f:
+                pickle.dump({
+                    "cache": {key: list(tweets) for key, tweets in self._gen_cache.items()},
+                    "batch": list(self._tweet_buffer)
+                }, f)
+        except Exception as e:
+            logger.error("Error saving generation cache: %s", e)
+    
+    def get_cached_generation(self, prompt_template):
+        # Return a cached tweet for this prompt template instead of calling the API, if possible
+        cache = self._gen_cache[prompt_template]
+        for tweet_text in [tweet for tweet in cache if self.is_posted(tweet)]:
+            cache.remove(tweet_text)
+        if len(cache) >= GEN_CACHE_MIN_HITS and random.random() < GEN_CACHE_HIT_RATE:
+            index = random.randrange(len(cache))
+            tweet_text = cache[index]
+            del cache[index]
+            logger.info("Using cached generation for prompt template")
+            return tweet_text
+        return None
+    
+    def is_breaker_open(self, name):
+        # Check whether calls to a provider are currently being skipped
+        return time.monotonic() < self._breaker[name]
+    
+    def trip_breaker(self, name, response):
+        # Skip a provider after a rate limit or server error, honouring Retry-After if given
+        if response.status_code != 429 and response.status_code < 500:
+            return
+        try:
+            delay = int(response.headers.get("Retry-After", BREAKER_DEFAULT_SECONDS))
+        except ValueError:
+            # Retry-After may also be an HTTP date; fall back to the default
+            delay = BREAKER_DEFAULT_SECONDS
+        self._breaker[name] = time.monotonic() + delay
+        logger.warning("Pausing %s API calls for %s seconds", name, delay)
+    
+    def format_tweet(self, generated_text):
+        # Clean up the text - remove surrounding quotes and whitespace in one pass
+        tweet_text = generated_text.strip(TWEET_STRIP_CHARS)
+        length = len(tweet_text)
+        if not length:
+            # Nothing was generated, so there is no tweet to hang a hashtag on
+            return None
+        
+        # Add a hashtag if there's space and the tweet doesn't already have one
+        # (the longest hashtag still fits within 280 characters)
+        if length < 260 and '#' not in tweet_text:
+            hashtag = self.HASHTAGS[random.randrange(self._n_hashtags)]
+            return f"{tweet_text} {hashtag}"
+        
+        if length > 280:
+            return tweet_text[:277] + "..."
+        
+        return tweet_text
     
-    def generate_tweet_with_huggingface(self):
-        # Generate tweet content using Hugging Face Inference API
+    def generate_tweet_local(self):
+        """
+        Generate tweet content locally by filling a template with company features
+        
+        Every feature is used before any is reworded, and never twice in a row, since
+        rewordings of one feature are too far apart in SimHash to be caught reliably
+        
+        Returns:
+            str: Generated tweet text, or None once every local sentence has been posted
+                 or would be a near-duplicate of a posted tweet
+        """
+        last_hash = self._posted_hashes[-1] if self._posted_hashes else None
+        last_features = {fill[3] for fill in self._local_fills if fill[4] == last_hash}
+        
+        # Only the hashtag varies between posts of the same fill, so compare without it
+        uses = collections.Counter()
+        fills = []
+        for fill in self._local_fills:
+            if self.is_posted(fill[0]):
+                uses[fill[3]] += 1
+            else:
+                fills.append(fill)
+        
+        random.shuffle(fills)
+        fills.sort(key=lambda fill: (fill[3] in last_features, uses[fill[3]]))
+        for sentence, template, verb, feature, _ in fills:
+            if not self.is_near_duplicate(sentence):
+                return template.format(verb=verb, feature=feature, hashtag=random.choice(self.HASHTAGS))
+        return None
     
+    def generate_tweet_with_huggingface(self, prompt_template):
+        """
+        Generate a batch of tweets using Hugging Face Inference API
+        Runs in a worker thread, so it only makes the HTTP call and leaves the cache alone
+        
+        Returns:
+            list: Generated tweet texts, or None if generation failed
+        """
         try:
-            # Select a random prompt template
-            prompt_template = random.choice(self.prompt_templates)
+            # Skip the API while it is rate limiting us or failing
+            if self.is_breaker_open("hf"):
+                return None
             
             # Create context for the AI
-            context = f"""
-            CryptoXpress is a platform that makes crypto easy for everyday use.
-            Key features:
-            - Trade 300+ cryptocurrencies with 900+ trading pairs with no commissions
-            - Book travel, accommodation, and experiences using crypto
-            - Pay bills and services with cryptocurrency
-            - Digital wallet for crypto holdings
-            - NFT management
-            - Bridge between crypto world and everyday life
-            
-            {prompt_template}
-            """
+            context = self.CONTEXT_PREFIX + prompt_template
     
             # Use the Hugging Face Inference API to generate content
-            API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
-            headers = {"Authorization": f"Bearer {self.hf_api_key}"} if self.hf_api_key else {}
-            
-            payload = {
-                "inputs": context,
-                "parameters": {
-                    "max_new_tokens": 300,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "do_sample": True
-                }
-            }
+            payload = {**self._hf_base_payload, "inputs": context}
             
-            response = requests.post(API_URL, headers=headers, json=payload)
+            response = self.http.post(self._hf_api_url, headers=self._hf_headers,
+                                      data=orjson.dumps(payload), timeout=HTTP_TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
-                # Extract the generated text
+                result = orjson.loads(response.content)
+                # Extract the generated texts
                 if isinstance(result, list) and len(result) > 0:
-                    generated_text = result[0].get('generated_text', '')
-                    # Remove the prompt from the generated text
-                    if generated_text.startswith(context):
-                        generated_text = generated_text[len(context):].strip()
+                    tweets = []
+                    for item in result:
+                        generated_text = item.get('generated_text', '')
+                        # Remove the prompt from the generated text
+                        if generated_text.startswith(context):
+                            generated_text = generated_text[len(context):].strip()
+                        tweet_text = self.format_tweet(generated_text)
+                        if tweet_text and tweet_text not in tweets:
+                            tweets.append(tweet_text)
                     
-                    # Clean up the text - trim to 280 chars and remove quotes if present
-                    tweet_text = generated_text.strip('"\'').strip()
-                    
-                    # Add a hashtag if there's space and the tweet doesn't already have one
-                    if len(tweet_text) < 260 and '#' not in tweet_text:
-                        hashtags = random.sample(self.hashtags, 1)
-                        tweet_text = f"{tweet_text} {hashtags[0]}"
-                    
-                    if len(tweet_text) > 280:
-                        tweet_text = tweet_text[:277] + "..."
-                    
-                    return tweet_text
+                    return tweets
                 else:
-                    logger.error(f"Unexpected response format from Hugging Face API: {result}")
+                    logger.error("Unexpected response format from Hugging Face API: %s", result)
             else:
-                logger.error(f"Error from Hugging Face API: {response.status_code} - {response.text}")
+                logger.error("Error from Hugging Face API: %s - %s", response.status_code, response.text)
+                self.trip_breaker("hf", response)
                 
             return None
             
         except Exception as e:
-            logger.error(f"Error generating tweet with Hugging Face AI: {str(e)}")
+            logger.error("Error generating tweet with Hugging Face AI: %s", e)
             return None
             
-    def generate_tweet_with_textgen(self):
+    def generate_tweet_with_textgen(self, prompt_template):
         """
         Generate tweet content using TextGen free API
+        Runs in a worker thread, so it only makes the HTTP call and leaves the cache alone
         
         Returns:
-            str: Generated tweet text, or None if generation failed
+            list: Generated tweet text, or None if generation failed
         """
         try:
-            # Select a random prompt template
-            prompt_template = random.choice(self.prompt_templates)
+            # Skip the API while it is rate limiting us or failing
+            if self.is_breaker_open("textgen"):
+                return None
             
             # Create context for the AI
-            context = f"""
-            CryptoXpress is a platform that makes crypto easy for everyday use.
-            Key features:
-            - Trade 300+ cryptocurrencies with 900+ trading pairs with no commissions
-            - Book travel, accommodation, and experiences using crypto
-            - Pay bills and services with cryptocurrency
-            - Digital wallet for crypto holdings
-            - NFT management
-            - Bridge between crypto world and everyday life
-            
-            {prompt_template}
-            """
+            context = self.CONTEXT_PREFIX + prompt_template
             
             # Use the TextGen.dev API which offers free inference
-            response = requests.post("https://api.textgen.dev/api/v1/generate", 
-                                    json={
-                                        "model": "Meta/Llama-3-8B-Instruct",
-                                        "prompt": context,
-                                        "max_tokens": 300,
-                                        "temperature": 0.7
-                                    })
+            response = self.http.post(f"{TEXTGEN_API_BASE}/api/v1/generate", 
+                                      headers=JSON_HEADERS,
+                                      data=orjson.dumps({
+                                          "model": "Meta/Llama-3-8B-Instruct",
+                                          "prompt": context,
+                                          "max_tokens": 300,
+                                          "temperature": 0.7
+                                      }),
+                                      timeout=HTTP_TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
-                generated_text = result.get('generated_text', '')
-                
-                # Clean up the text - trim to 280 chars and remove quotes if present
-                tweet_text = generated_text.strip('"\'').strip()
-                
-                # Add a hashtag if there's space and the tweet doesn't already have one
-                if len(tweet_text) < 260 and '#' not in tweet_text:
-                    hashtags = random.sample(self.hashtags, 1)
-                    tweet_text = f"{tweet_text} {hashtags[0]}"
-                
-                if len(tweet_text) > 280:
-                    tweet_text = tweet_text[:277] + "..."
-                
-                return tweet_text
+                result = orjson.loads(response.content)
+                tweet_text = self.format_tweet(result.get('generated_text') or '')
+                if tweet_text:
+                    return [tweet_text]
+                logger.error("Empty response from TextGen API")
             else:
-                logger.error(f"Error from TextGen API: {response.status_code} - {response.text}")
+                logger.error("Error from TextGen API: %s - %s", response.status_code, response.text)
+                self.trip_breaker("textgen", response)
                 
             return None
             
         except Exception as e:
-            logger.error(f"Error generating tweet with TextGen: {str(e)}")
+            logger.error("Error generating tweet with TextGen: %s", e)
             return None
+    
+    def is_new_tweet(self, tweet_text):
+        # Check a generated tweet against posted tweets, exactly and as a rewording
+        return bool(tweet_text) and not self.is_posted(tweet_text) and not self.is_near_duplicate(tweet_text)
+    
+    def cache_generated_tweets(self, prompt_template, new_tweets):
+        # Keep generated tweets, already checked with is_new_tweet, for later posts with this template
+        cache = self._gen_cache[prompt_template]
+        for tweet_text in new_tweets:
+            if tweet_text not in cache:
+                cache.append(tweet_text)
             
-    def get_ai_generated_content(self):
+    async def get_ai_generated_content(self):
+
+        # Local templates are near instant, so only call the AI APIs once they run out
+        tweet_text = self.generate_tweet_local()
+        if tweet_text:
+            return tweet_text
+
+        # Serve leftovers from the last Hugging Face batch before calling any API
+        while self._tweet_buffer:
+            tweet_text = self._tweet_buffer.popleft()
+            if self.is_new_tweet(tweet_text):
+                return tweet_text
+
+        # Select a random prompt template and try the generation cache before any API
+        prompt_template = self.PROMPT_TEMPLATES[random.randrange(self._n_prompts)]
+        tweet_text = self.get_cached_generation(prompt_template)
+        if tweet_text and self.is_new_tweet(tweet_text):
+            return tweet_text
 
-        # Try different generation methods in order of preference
+        # Race the generation methods and take the first valid tweet
         methods = [
             self.generate_tweet_with_huggingface,
             self.generate_tweet_with_textgen
         ]
         
-        # Try each method until we get a valid tweet
-        for method in methods:
-            try:
-                tweet_text = method()
-                if tweet_text and len(tweet_text) > 0:
-                    # Check if it's a duplicate
-                    if tweet_text in self.posted_tweets:
-                        logger.info("Generated duplicate tweet, retrying...")
-                        continue
-                    return tweet_text
-            except Exception as e:
-                logger.error(f"Error with AI generation method {method.__name__}: {str(e)}")
-                continue
+        # The generators are blocking, so run only them in the default thread pool.
+        # Checking and caching their results stays on the event loop thread
+        loop = asyncio.get_running_loop()
+        pending = {loop.run_in_executor(None, method, prompt_template): method for method in methods}
+        
+        def keep_late_result(task):
+            if task.cancelled() or task.exception() is not None or not task.result():
+                return
+            tweets = task.result()
+            new_tweets = [tweet for tweet in tweets if self.is_new_tweet(tweet)]
+            if len(tweets) > 1:
+                # A batch goes to the buffer so it is used up before the next API call
+                self._tweet_buffer.extend(new_tweets)
+            else:
+                self.cache_generated_tweets(prompt_template, new_tweets)
+        
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    method = pending.pop(task)
+                    try:
+                        tweets = task.result() or []
+                        new_tweets = [tweet for tweet in tweets if self.is_new_tweet(tweet)]
+                        if new_tweets:
+                            # Keep the rest of a batch for the next posts
+                            self._tweet_buffer.extend(new_tweets[1:])
+                            return new_tweets[0]
+                        if tweets:
+                            logger.info("Generated duplicate tweet, waiting for other methods...")
+                    except Exception as e:
+                        logger.error("Error with AI generation method %s: %s", method.__name__, e)
+        finally:
+            # A running request can't be interrupted, so let the slower one finish in the
+            # background and keep whatever it generates for later
+            for task in pending:
+                task.add_done_callback(keep_late_result)
         
         # If all methods fail, use a backup tweet
-        available_tweets = [tweet for tweet in self.backup_tweets if tweet not in self.posted_tweets]
-        if not available_tweets:
+        if not self._avail_backups:
             # If all backup tweets have been used, reset
-            available_tweets = self.backup_tweets
+            self._avail_backups = set(self.BACKUP_TWEETS)
             
-        return random.choice(available_tweets)
+        return random.choice(tuple(self._avail_backups))
 
-    def post_tweet(self):
+    async def post_tweet(self):
+        import tweepy
+        
         try:
-            tweet_text = self.get_ai_generated_content()
+            tweet_text = await self.get_ai_generated_content()
             
             if not tweet_text:
                 logger.error("Failed to get content for tweet")
                 return False
                 
             # Post the tweet
-            response = self.twitter_client.create_tweet(text=tweet_text)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, lambda: self.twitter_client.create_tweet(text=tweet_text))
+            self.update_rate_limit(response.headers)
             
             # Save the tweet to avoid duplicates
-            self.posted_tweets.add(tweet_text)
             self.save_posted_tweet(tweet_text)
+            self._avail_backups.discard(tweet_text)
             
-            logger.info(f"Posted tweet: {tweet_text}")
+            logger.info("Posted tweet: %s", tweet_text)
             return True
+        except tweepy.TooManyRequests as e:
+            self.update_rate_limit(e.response.headers)
+            logger.error("Twitter rate limit reached: %s", e)
+            return False
         except Exception as e:
-            logger.error(f"Error posting tweet: {str(e)}")
+            logger.error("Error posting tweet: %s", e)
             return False
     
     def run(self, interval_minutes=60, randomize_interval=True, max_runtime_hours=None):
+        """
+        Blocking wrapper around run_async
+        Inside an already running event loop (Jupyter, Colab) asyncio.run() can't be used,
+        so the bot is scheduled on that loop instead and the task is returned; await it,
+        or call `await bot.run_async(...)` directly, to wait for the bot to finish
+        """
+        coro = self.run_async(interval_minutes=interval_minutes,
+                              randomize_interval=randomize_interval,
+                              max_runtime_hours=max_runtime_hours)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        
+        logger.info("Event loop already running, scheduling the bot in the background")
+        task = loop.create_task(coro)
+        bot_tasks.add(task)
+        task.add_done_callback(bot_tasks.discard)
+        return task
+    
+    async def run_async(self, interval_minutes=60, randomize_interval=True, max_runtime_hours=None):
        # Run the bot continuously, posting tweets at regular intervals
        
-        logger.info(f"CryptoXpress Bot started. Using AI-generated content. Posting interval: {interval_minutes} minutes.")
+        logger.info("CryptoXpress Bot started. Using AI-generated content. Posting interval: %s minutes.", interval_minutes)
         if max_runtime_hours:
-            logger.info(f"Bot will run for maximum {max_runtime_hours} hours")
+            logger.info("Bot will run for maximum %s hours", max_runtime_hours)
             end_time = time.time() + (max_runtime_hours * 3600)
         else:
             end_time = None
@@ -314,12 +757,12 @@ class CryptoXpressBot:
         while True:
             # Check if runtime limit has been reached
             if end_time and time.time() > end_time:
-                logger.info(f"Maximum runtime of {max_runtime_hours} hours reached. Stopping the bot.")
+                logger.info("Maximum runtime of %s hours reached. Stopping the bot.", max_runtime_hours)
                 break
                 
             try:
                 # Post a tweet
-                success = self.post_tweet()
+                success = await self.post_tweet()
                 
                 if success:
                     # Calculate next interval (add randomness if enabled)
@@ -330,26 +773,38 @@ class CryptoXpressBot:
                     else:
                         next_interval = interval_minutes
                     
+                    # Slow down if the rate limit window would run out before it resets
+                    rate_limit_delay = self.get_rate_limit_delay()
+                    if rate_limit_delay > next_interval * 60:
+                        next_interval = rate_limit_delay / 60
+                        logger.info("Adjusting interval for rate limit: %s tweets left in window", self._rate_limit_remaining)
+                    
                     # Calculate and log next post time
-                    next_post_datetime = datetime.now().timestamp() + (next_interval * 60)
-                    next_post_time = datetime.fromtimestamp(next_post_datetime).strftime('%H:%M:%S')
-                    logger.info(f"Next tweet scheduled in {next_interval:.1f} minutes (around {next_post_time})")
+                    next_post_time = (datetime.now() + timedelta(minutes=next_interval)).strftime('%H:%M:%S')
+                    logger.info("Next tweet scheduled in %.1f minutes (around %s)", next_interval, next_post_time)
                     
                     # Sleep until next interval
-                    time.sleep(next_interval * 60)
+                    await asyncio.sleep(next_interval * 60)
+                elif self._rate_limit_remaining == 0 and self.get_rate_limit_delay() > 0:
+                    # If the rate limit is used up, wait until the window resets
+                    retry_delay = self.get_rate_limit_delay()
+                    logger.warning("Tweet rate limit reached. Retrying in %.1f minutes...", retry_delay / 60)
+                    await asyncio.sleep(retry_delay)
                 else:
                     # If posting failed, wait a shorter time before retry
                     logger.warning("Tweet posting failed. Retrying in 10 minutes...")
-                    time.sleep(600)  # 10 minutes
+                    await asyncio.sleep(600)  # 10 minutes
                     
             except Exception as e:
-                logger.error(f"Error in main loop: {str(e)}")
+                logger.error("Error in main loop: %s", e)
                 logger.info("Waiting 15 minutes before continuing...")
-                time.sleep(900)  # 15 minutes
+                await asyncio.sleep(900)  # 15 minutes
 
 
 def run_twitter_bot(consumer_key, consumer_secret, access_token, access_token_secret,
                    hf_api_key=None, interval_minutes=1, randomize_interval=True, max_runtime_hours=12):
+    setup_logging()
+    
     # Twitter API credentials
     twitter_creds = {
         'consumer_key': consumer_key,
@@ -361,14 +816,21 @@ def run_twitter_bot(consumer_key, consumer_secret, access_token, access_token_se
     # Create and run the bot
     bot = CryptoXpressBot(twitter_creds, hf_api_key=hf_api_key)
     
-    # Run the bot with the specified settings
-    bot.run(interval_minutes=interval_minutes, 
-            randomize_interval=randomize_interval,
-            max_runtime_hours=max_runtime_hours)
+    # Run the bot with the specified settings; in a notebook this returns the background task
+    return bot.run(interval_minutes=interval_minutes, 
+                   randomize_interval=randomize_interval,
+                   max_runtime_hours=max_runtime_hours)
 
 
 # Main execution block
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    
+    setup_logging()
+    
+    # Load environment variables
+    load_dotenv()
+    
     # Get Twitter API credentials
     # For Google Colab
     try: